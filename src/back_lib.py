@@ -1,5 +1,5 @@
-import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Callable, Optional
 
@@ -81,13 +81,9 @@ def get_periodic_backup_type():
     '''
 
     gmtime = time.gmtime(now)
+    year_month, day, hour = time.strftime('%Y_%m %d %H', gmtime).split(' ')
     minutes = (gmtime.tm_min // 10) * 10
-    return [
-      f'{gmtime.tm_year:04d}_{gmtime.tm_mon:02d}',
-      f'{gmtime.tm_mday:02d}',
-      f'{gmtime.tm_hour:02d}',
-      f'{minutes:02d}',
-    ]
+    return [year_month, day, hour, f'{minutes:02d}']
 
   max_level_ages = [
     0,
@@ -107,124 +103,205 @@ def get_periodic_backup_type():
     get_level_names=get_level_names,
   )
 
+periodic_backup_type = get_periodic_backup_type()
+periodic_level_prefix = f'{periodic_backup_type.periodic_prefix}__lvl_'
+prune_lookup_workers = 4
+
+@dataclass
+class RitSession:
+  '''
+  a handle on a rit directory shared by the backup api calls
+
+  rit_lib runs in process, so there is no worker to keep alive between calls.
+  What does repeat is re-reading the rit directory, so the session keeps a
+  single query snapshot and only drops it after it mutates the rit directory.
+  '''
+
+  rit_dir: str
+  ''' the root rit directory '''
+
+  _rit_res: Optional[rit_lib.RitResource] = None
+  ''' cache for query '''
+
+  def query(self):
+    ''' returns a read only RitResource, shared until the next mutation '''
+    if self._rit_res is None:
+      self._rit_res = rit_lib.query_cmd(root_rit_dir=self.rit_dir)
+    return self._rit_res
+
+  def commit(self, msg: str):
+    self._rit_res = None
+    return rit_lib.commit_cmd(root_rit_dir=self.rit_dir, msg=msg)
+
+  def checkout(self, *, orphan: bool, ref_or_name: str, force: Optional[bool]):
+    self._rit_res = None
+    return rit_lib.checkout_cmd(root_rit_dir=self.rit_dir, orphan=orphan, ref_or_name=ref_or_name, force=force)
+
+  def reset(self, *, ref: Optional[str], hard: bool):
+    self._rit_res = None
+    return rit_lib.reset_cmd(root_rit_dir=self.rit_dir, ref=ref, hard=hard)
+
+  def switch_branch(self, *, name: str):
+    self._rit_res = None
+    return rit_lib.switch_branch_cmd(root_rit_dir=self.rit_dir, name=name)
+
+  def branch(self, *, name: Optional[str], ref: Optional[str], force: bool, delete: bool):
+    self._rit_res = None
+    return rit_lib.branch_cmd(root_rit_dir=self.rit_dir, name=name, ref=ref, force=force, delete=delete)
+
+  def batch_branch(self, updates: list[tuple[str, Optional[str], bool, bool]]):
+    self._rit_res = None
+    return rit_lib.batch_branch_cmd(root_rit_dir=self.rit_dir, updates=updates)
+
+  def delete_branches(self, names: list[str]):
+    self._rit_res = None
+    return rit_lib.delete_branches_cmd(root_rit_dir=self.rit_dir, names=names)
+
+  def prune(self):
+    self._rit_res = None
+    return rit_lib.prune_cmd(root_rit_dir=self.rit_dir)
+
 ''' api '''
 
-def create_backup(rit_dir: str, msg: str):
-  backup_type = get_periodic_backup_type()
+def create_backup(rit_dir: str, msg: str, session: Optional[RitSession] = None):
+  if session is None:
+    session = RitSession(rit_dir)
   backup_time = time.time()
-  level_names = backup_type.get_level_names(backup_time)
+  level_names = periodic_backup_type.get_level_names(backup_time)
   if len(level_names) < 2:
     raise rit_lib.RitError("Not enough levels we need at least 2")
   branch_names: list[str] = []
-  previous_level_name = ''
+  level_name_parts: list[str] = []
   for level, level_name in enumerate(level_names):
-    if previous_level_name:
-      full_level_name = f"{previous_level_name}_{level_name}"
-    else:
-      full_level_name = level_name
-    branch_names.push(f"{backup_type.periodic_prefix}__lvl_{level}__{full_level_name}")
-    previous_level_name = full_level_name
-  branch_names.reverse()
-
-  rit_res = rit_lib.query_cmd(root_rit_dir=rit_dir)
+    level_name_parts.append(level_name)
+    branch_names.append(periodic_level_prefix + str(level) + '__' + '_'.join(level_name_parts))
+
+  rit_res = session.query()
   base_branch: Optional[rit_lib.Branch] = None
-  while branch_names:
-    branch_name = branch_names.pop()
+  for idx, branch_name in enumerate(branch_names):
     branch = rit_res.get_branch(branch_name)
-    if branch is not None:
-      base_branch = branch
-    else:
+    if branch is None:
       break
+    base_branch = branch
+  remaining_branch_names = branch_names[idx + 1:]
+  # the session drops its snapshot on the first mutation below; don't keep it
+  # alive here
+  del rit_res
 
   if base_branch is None:
-    rit_lib.checkout_cmd(root_rit_dir=rit_dir, orphan=True, ref_or_name=branch_name, force=None)
-    backup_commit = rit_lib.commit_cmd(root_rit_dir=rit_dir, msg=msg)
+    session.checkout(orphan=True, ref_or_name=branch_name, force=None)
+    backup_commit = session.commit(msg=msg)
   elif branch is None:
-    rit_lib.branch_cmd(root_rit_dir=rit_dir, name=branch_name, ref=None, force=True, delete=False)
-    rit_lib.checkout_cmd(root_rit_dir=rit_dir, orphan=False, ref_or_name=branch_name, force=False)
-    rit_lib.reset_cmd(root_rit_dir=rit_dir, ref=base_branch.name, hard=False)
-    backup_commit = rit_lib.commit_cmd(root_rit_dir=rit_dir, msg=msg)
+    session.branch(name=branch_name, ref=base_branch.name, force=True, delete=False)
+    session.switch_branch(name=branch_name)
+    backup_commit = session.commit(msg=msg)
   else:
-    if rit_res.head.branch_name is not None:
-      branch = rit_res.get_branch(rit_res.head.branch_name)
-      if branch is not None:
-        rit_lib.checkout_cmd(root_rit_dir=rit_dir, orphan=False, ref_or_name=branch.commit_id, force=False)
-    rit_lib.reset_cmd(root_rit_dir=rit_dir, ref=branch_name, hard=False)
-    rit_lib.checkout_cmd(root_rit_dir=rit_dir, orphan=False, ref_or_name=branch_name, force=False)
-    backup_commit = rit_lib.commit_cmd(root_rit_dir=rit_dir, msg=msg)
+    session.switch_branch(name=branch_name)
+    backup_commit = session.commit(msg=msg)
 
-  for branch_name in branch_names:
-    rit_lib.branch_cmd(root_rit_dir=rit_dir, name=branch_name, ref=backup_commit.commit_id, force=True, delete=False)
+  session.batch_branch([
+    (branch_name, backup_commit.commit_id, True, False)
+    for branch_name in remaining_branch_names
+  ])
 
   return backup_commit
 
-def manual_backup(rit_dir: str, msg: str, branch_name: str):
-  backup_type = get_periodic_backup_type()
-  full_branch_name = f'{backup_type.manual_prefix}__{branch_name}'
-  backup = create_backup(rit_dir, msg)
-  rit_lib.branch_cmd(root_rit_dir=rit_dir, name=full_branch_name, ref=backup.commit_id, force=True, delete=False)
-
-def quick_backup(rit_dir: str):
-  backup_type = get_periodic_backup_type()
-  backup = create_backup(rit_dir, 'Quick backup')
-  shift_branches(rit_dir, backup_type.quick_count, backup_type.quick_prefix, 'global', backup.commit_id)
-
-def prune_backup(rit_dir: str):
-  backup_type = get_periodic_backup_type()
+def manual_backup(rit_dir: str, msg: str, branch_name: str, session: Optional[RitSession] = None):
+  if session is None:
+    session = RitSession(rit_dir)
+  full_branch_name = f'{periodic_backup_type.manual_prefix}__{branch_name}'
+  backup = create_backup(rit_dir, msg, session)
+  session.branch(name=full_branch_name, ref=backup.commit_id, force=True, delete=False)
+
+def quick_backup(rit_dir: str, session: Optional[RitSession] = None):
+  if session is None:
+    session = RitSession(rit_dir)
+  backup = create_backup(rit_dir, 'Quick backup', session)
+  shift_branches(rit_dir, periodic_backup_type.quick_count, periodic_backup_type.quick_prefix, 'global', backup.commit_id, session)
+
+def prune_backup(rit_dir: str, session: Optional[RitSession] = None):
+  if session is None:
+    session = RitSession(rit_dir)
   now = time.time()
-  regex = re.compile(f'{backup_type.periodic_prefix}__level_(\\d+)__')
-  rit_res = rit_lib.query_cmd(root_rit_dir=rit_dir)
-  branch_names = rit_res.get_branch_names()
-  pending_prune = []
-  for branch_name in branch_names:
-    match = regex.match(branch_name)
-    if match is None:
-      continue
-    level = int(match.groups()[0])
-    max_age = backup_type.max_level_ages[level]
+  rit_res = session.query()
+
+  def is_expired(branch_name: str):
+    if not branch_name.startswith(periodic_level_prefix):
+      return False
+    level, sep, _ = branch_name[len(periodic_level_prefix):].partition('__')
+    if not sep or not level.isdecimal():
+      return False
+    max_age = periodic_backup_type.max_level_ages[int(level)]
     if max_age == 0:
-      continue
+      return False
 
     branch = rit_res.get_branch(branch_name)
     if branch is None:
-      continue
+      return False
     commit = rit_res.get_commit(branch.commit_id)
     if commit is None:
-      continue
+      return False
     age = now - commit.create_time
-    if age > max_age:
-      pending_prune.append(branch_name)
+    return age > max_age
+
+  # each lookup reads at most a branch file and a commit file, so a few threads
+  # overlap that I/O. RitResource isn't thread safe: the only shared state
+  # touched here is its lazy branch and commit caches, where racing threads at
+  # worst both read a file and insert equal values for the same key. deletes
+  # happen after the pool is done.
+  branch_names = rit_res.get_branch_names()
+  with ThreadPoolExecutor(max_workers=prune_lookup_workers) as executor:
+    expired = executor.map(is_expired, branch_names)
+    pending_prune = [
+      branch_name
+      for branch_name, branch_expired in zip(branch_names, expired)
+      if branch_expired
+    ]
 
-  for branch_name in pending_prune:
-    rit_res = rit_lib.branch_cmd(root_rit_dir=rit_dir, name=branch_name, ref=None, force=False, delete=True)
-  rit_lib.prune_cmd(root_rit_dir=rit_dir)
+  session.delete_branches(pending_prune)
+  session.prune()
 
-def restore_to_point(rit_dir: str, ref: Optional[str]):
-  backup_type = get_periodic_backup_type()
-  rit_res = rit_lib.query_cmd(root_rit_dir=rit_dir)
+def restore_to_point(rit_dir: str, ref: Optional[str], session: Optional[RitSession] = None):
+  if session is None:
+    session = RitSession(rit_dir)
+  rit_res = session.query()
   res = rit_lib.resolve_ref(rit_res, ref)
   if res.commit is None:
     raise rit_lib.RitError("Unable to resolve restore point's commit")
+  del rit_res
+
+  pre_restore_commit = create_backup(rit_dir, "Before restoration", session)
+  session.checkout(orphan=False, ref_or_name=res.commit.commit_id, force=True)
 
-  pre_restore_commit = create_backup(rit_dir, "Before restoration")
-  rit_lib.checkout_cmd(root_rit_dir=rit_dir, orphan=False, ref_or_name=res.commit.commit_id, force=True)
+  shift_branches_multi(rit_dir, periodic_backup_type.restore_count, periodic_backup_type.restore_prefix, {
+    'before': pre_restore_commit.commit_id,
+    'after': res.commit.commit_id,
+  }, session)
 
-  shift_branches(rit_dir, backup_type.restore_count, backup_type.restore_prefix, 'before', pre_restore_commit.commit_id)
-  shift_branches(rit_dir, backup_type.restore_count, backup_type.restore_prefix, 'after', res.commit.commit_id)
+def shift_branches(rit_dir: str, max_count: int, prefix: str, suffix: str, new_initial: Optional[str], session: Optional[RitSession] = None):
+  shift_branches_multi(rit_dir, max_count, prefix, {suffix: new_initial}, session)
 
-def shift_branches(rit_dir: str, max_count: int, prefix: str, suffix: str, new_initial: Optional[str]):
+def shift_branches_multi(rit_dir: str, max_count: int, prefix: str, suffixes_to_initial: dict[str, Optional[str]], session: Optional[RitSession] = None):
+  ''' shift_branches for several suffixes with one query and one batched update '''
+  if session is None:
+    session = RitSession(rit_dir)
   # build branch update map
+  name_prefix = prefix + '__idx_'
   shift_updates = {}
-  if new_initial is not None:
-    shift_updates[f'{prefix}__idx_1__{suffix}'] = new_initial
-  rit_res = rit_lib.query_cmd(root_rit_dir=rit_dir)
-  for idx in range(max_count-1, 0, -1):
-    current_name = f'{prefix}__idx_{idx}__{suffix}'
-    updated_name = f'{prefix}__idx_{idx + 1}__{suffix}'
-    current = rit_res.get_branch(current_name)
-    if current is None:
-      continue
-    shift_updates[updated_name] = current.commit_id
-
-  for branch_name, branch_commit in shift_updates.items():
-    rit_lib.branch_cmd(root_rit_dir=rit_dir, name=branch_name, ref=branch_commit, force=True, delete=False)
+  rit_res = session.query()
+  for suffix, new_initial in suffixes_to_initial.items():
+    name_suffix = '__' + suffix
+    if new_initial is not None:
+      shift_updates[name_prefix + '1' + name_suffix] = new_initial
+    for idx in range(max_count-1, 0, -1):
+      current_name = name_prefix + str(idx) + name_suffix
+      updated_name = name_prefix + str(idx + 1) + name_suffix
+      current = rit_res.get_branch(current_name)
+      if current is None:
+        continue
+      shift_updates[updated_name] = current.commit_id
+
+  session.batch_branch([
+    (branch_name, branch_commit, True, False)
+    for branch_name, branch_commit in shift_updates.items()
+  ])
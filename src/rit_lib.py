@@ -2,18 +2,30 @@ from io import DEFAULT_BUFFER_SIZE
 import subprocess
 import shutil
 import argparse
-import datetime
+import bisect
+import functools
 import hashlib
 import json
 import logging
 import os
 import re
 import sys
+import tempfile
 import time
-from dataclasses import asdict, dataclass, field
+from dataclasses import dataclass, field
 from typing import Optional
 from collections import defaultdict
 
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
 
 ''' GLOBALS '''
 
@@ -21,14 +33,28 @@ logger = logging.getLogger(__name__)
 rit_dir_name = '.rit'
 default_branch_name = 'main'
 head_ref_name = 'HEAD'
+commit_index_name = 'commit_index'
 short_hash_index = 7
+rit_paths_cache = {}
+hash_chunk_size = 1 << 20
+pipe_chunk_size = 1 << 16
+# FICLONE from linux/fs.h, fcntl only names it on python 3.12+
+ficlone_request = 0x40049409
+small_file_read_size = 1 << 12
 fg = 30
 bg = 40
 black, red, green, yellow, blue, magenta, cyan, white = range(8)
+# setup_logger turns this off when the log isn't going to a terminal
+use_color = True
+reset_seq = "\033[0m"
+color_seqs = {color: "\033[1;{}m".format(color) for color in range(fg, bg + 8)}
 
 ''' STRUCTS '''
 
-@dataclass
+# slots make the many Commit, Branch, etc. objects smaller and faster to use
+struct_opts = dict(slots=True) if sys.version_info >= (3, 10) else {}
+
+@dataclass(**struct_opts)
 class RitPaths:
   ''' a class that represents the various directories used by rit '''
 
@@ -81,7 +107,7 @@ class RitPaths:
       work = work,
     )
 
-@dataclass
+@dataclass(**struct_opts)
 class Commit:
   ''' represents a single commit '''
 
@@ -98,14 +124,16 @@ class Commit:
   ''' the commit msg'''
 
   def __post_init__(self):
-    check_obj_types(self, dict(
-      parent_commit_id = optional_t(exact_t(str)),
-      commit_id = exact_t(str),
-      create_time = exact_t(float),
-      msg = exact_t(str),
-    ))
-
-@dataclass
+    if self.parent_commit_id is not None and not isinstance(self.parent_commit_id, str):
+      raise TypeError(f"Element had invalid type: parent_commit_id: {type(self.parent_commit_id)}")
+    if not isinstance(self.commit_id, str):
+      raise TypeError(f"Element had invalid type: commit_id: {type(self.commit_id)}")
+    if not isinstance(self.create_time, float):
+      raise TypeError(f"Element had invalid type: create_time: {type(self.create_time)}")
+    if not isinstance(self.msg, str):
+      raise TypeError(f"Element had invalid type: msg: {type(self.msg)}")
+
+@dataclass(**struct_opts)
 class Branch:
   ''' represents a branch '''
 
@@ -116,12 +144,12 @@ class Branch:
   ''' the commit id tied to the branch '''
 
   def __post_init__(self):
-    check_obj_types(self, dict(
-      name = exact_t(str),
-      commit_id = exact_t(str),
-    ))
+    if not isinstance(self.name, str):
+      raise TypeError(f"Element had invalid type: name: {type(self.name)}")
+    if not isinstance(self.commit_id, str):
+      raise TypeError(f"Element had invalid type: commit_id: {type(self.commit_id)}")
 
-@dataclass
+@dataclass(**struct_opts)
 class HeadNode:
   '''
   The rit directory's current location. This is a branch or a commit. It is
@@ -139,10 +167,10 @@ class HeadNode:
   ''' the current head is tied to this branch. new commits move the branch. '''
 
   def __post_init__(self):
-    check_obj_types(self, dict(
-      commit_id = optional_t(exact_t(str)),
-      branch_name = optional_t(exact_t(str)),
-    ))
+    if self.commit_id is not None and not isinstance(self.commit_id, str):
+      raise TypeError(f"Element had invalid type: commit_id: {type(self.commit_id)}")
+    if self.branch_name is not None and not isinstance(self.branch_name, str):
+      raise TypeError(f"Element had invalid type: branch_name: {type(self.branch_name)}")
     if (self.commit_id is None) == (self.branch_name is None):
       raise TypeError(head_ref_name + " must be a branch name or a commit id")
 
@@ -167,10 +195,11 @@ class RitResource:
 
   All interactions with the rit directory should go through this object.
 
-  Any external changes to the rit directory invalidate's this object's cache and
-  in that case, _clear should be called. However, no user of this resource
-  should be calling _clear. Instead this class' api should be extended and that
-  new method should call _clear.
+  Mutations made through this object update only the caches they affect, so
+  nothing in rit needs to clear the whole cache. Changes made to the rit
+  directory outside of this object invalidate its cache, and _clear is kept as
+  the hook for that case. Prefer extending this class' api with a method that
+  updates the caches it affects over calling _clear.
 
   TODO: ensure all mutations of the rit directory are through this object, e.g.,
   tar creation / deletion.
@@ -210,13 +239,21 @@ class RitResource:
   _commit_ids: list[str] = None
   ''' cache for get_commit_ids '''
 
-  _short_commit_tree: dict[str, list[str]] = None
-  ''' cache for get_commit_tree '''
+  _sorted_commit_ids: list[str] = None
+  ''' cache for get_sorted_commit_ids '''
+
+  _resolved_refs: dict[Optional[str], 'ResolvedRef'] = field(default_factory=dict)
+  ''' cache for resolve_ref '''
+
+  _commits_loaded: bool = False
+  ''' whether _commits holds every commit in _commit_ids, see load_commits '''
+
+  _commit_index_stale: bool = False
+  ''' whether the packed commit index on disk doesn't match _commit_ids '''
 
   def __post_init__(self) -> None:
-    check_obj_types(self, dict(
-      root_rit_dir = exact_t(str),
-    ))
+    if not isinstance(self.root_rit_dir, str):
+      raise TypeError(f"Element had invalid type: root_rit_dir: {type(self.root_rit_dir)}")
 
   def initialize(self):
     '''
@@ -226,12 +263,14 @@ class RitResource:
     '''
     try:
       paths = RitPaths.build_rit_paths(self.root_rit_dir, init=True)
+      # a new rit directory may be closer than one found before
+      rit_paths_cache.clear()
       logger.info("Successfully created rit directory: %s", paths.rit_dir)
     except FileExistsError:
       raise RitError("The rit directory already exists: %s", self.paths.rit_dir)
 
   def _clear(self):
-    ''' If the rit directory is modified, then the cache must be cleared '''
+    ''' drop every cache, for when the rit directory was modified externally '''
     cleared_rit = RitResource(self.root_rit_dir)
     self._head = cleared_rit._head
     self._commits = cleared_rit._commits
@@ -240,7 +279,20 @@ class RitResource:
     self._commit_id_to_branch_names = cleared_rit._commit_id_to_branch_names
     self._branch_names = cleared_rit._branch_names
     self._commit_ids = cleared_rit._commit_ids
-    self._short_commit_tree = cleared_rit._short_commit_tree
+    self._sorted_commit_ids = cleared_rit._sorted_commit_ids
+    self._resolved_refs = cleared_rit._resolved_refs
+    self._commits_loaded = cleared_rit._commits_loaded
+    self._commit_index_stale = cleared_rit._commit_index_stale
+
+  def _clear_ref_caches(self):
+    '''
+    the commit <-> branch maps and resolved refs must be cleared if a branch or
+    head changes. resolved refs must also be cleared if commits are added or
+    removed, since that changes what partial commit ids match.
+    '''
+    self._branch_name_to_commit_ids = None
+    self._commit_id_to_branch_names = None
+    self._resolved_refs = {}
 
   ''' SET '''
 
@@ -249,9 +301,19 @@ class RitResource:
     if self.prevent_mutations:
       raise RitError("Doing this would mutate the rit directory, and that is disabled for this RitResource")
     self._write_commit(commit)
-    self._clear()
+    self._commits[commit.commit_id] = commit
+    if self._commit_ids is not None:
+      self._commit_ids = self._commit_ids + [commit.commit_id]
+    if self._sorted_commit_ids is not None:
+      sorted_commit_ids = list(self._sorted_commit_ids)
+      bisect.insort(sorted_commit_ids, commit.commit_id)
+      self._sorted_commit_ids = sorted_commit_ids
+    self._resolved_refs = {}
+    self._commit_index_stale = True
+    self._update_commit_index()
 
   def prune(self):
+    self.load_commits()
     leaf_commits = set()
     if self.head.commit_id is not None:
       leaf_commits.add(self.head.commit_id)
@@ -273,6 +335,18 @@ class RitResource:
         continue
       self._delete_commit(commit_id)
       removed_commit_ids.append(commit_id)
+
+    if removed_commit_ids:
+      # filtered rather than reset, so every remaining commit stays loaded
+      removed = set(removed_commit_ids)
+      for commit_id in removed_commit_ids:
+        self._commits.pop(commit_id, None)
+      self._commit_ids = [commit_id for commit_id in self._commit_ids if commit_id not in removed]
+      if self._sorted_commit_ids is not None:
+        self._sorted_commit_ids = [commit_id for commit_id in self._sorted_commit_ids if commit_id not in removed]
+      self._resolved_refs = {}
+      self._commit_index_stale = True
+    self._update_commit_index()
     return removed_commit_ids
 
   def set_branch(self, branch: Branch):
@@ -280,14 +354,35 @@ class RitResource:
     if self.prevent_mutations:
       raise RitError("Doing this would mutate the rit directory, and that is disabled for this RitResource")
     self._write_branch(branch)
-    self._clear()
+    self._branches[branch.name] = branch
+    if self._branch_names is not None and branch.name not in self._branch_names:
+      self._branch_names = self._branch_names + [branch.name]
+    self._clear_ref_caches()
+
+  def remove_branch(self, name: str):
+    ''' remove the branch from the rit dir '''
+    self.remove_branches([name])
+
+  def remove_branches(self, names: list[str]):
+    ''' remove the branches from the rit dir '''
+    if self.prevent_mutations:
+      raise RitError("Doing this would mutate the rit directory, and that is disabled for this RitResource")
+    try:
+      for name in names:
+        self._delete_branch(name)
+    finally:
+      for name in names:
+        self._branches.pop(name, None)
+      self._branch_names = None
+      self._clear_ref_caches()
 
   def set_head(self, head: HeadNode):
     ''' set the new head point '''
     if self.prevent_mutations:
       raise RitError("Doing this would mutate the rit directory, and that is disabled for this RitResource")
     self._write_head(head)
-    self._clear()
+    self._head = head
+    self._clear_ref_caches()
 
   ''' GET '''
 
@@ -340,6 +435,40 @@ class RitResource:
         return None
     return self._commits[commit_id]
 
+  def load_commits(self):
+    '''
+    load every commit into the cache and return the commit id to commit map
+
+    Commits are read from the packed commit index when it's current. Commit
+    files missing from the index are read individually. This never writes, the
+    index is refreshed by the methods that add or remove commits.
+
+    Only the first call reads the index, later calls return the cached commits.
+    '''
+    commit_ids = self.get_commit_ids()
+    if self._commits_loaded:
+      return {commit_id: self._commits[commit_id] for commit_id in commit_ids}
+    index = self._read_commit_index()
+    stale = len(index) != len(commit_ids)
+    for commit_id in commit_ids:
+      if commit_id in self._commits:
+        stale = stale or commit_id not in index
+        continue
+      try:
+        self._commits[commit_id] = Commit(**dict(**index[commit_id], commit_id=commit_id))
+      except (KeyError, TypeError):
+        stale = True
+        self.get_commit(commit_id, ensure=True)
+    self._commit_index_stale = stale
+    self._commits_loaded = True
+    return {commit_id: self._commits[commit_id] for commit_id in commit_ids}
+
+  def _update_commit_index(self):
+    ''' rewrite the packed commit index if it doesn't match the commits '''
+    commits = self.load_commits()
+    if self._commit_index_stale:
+      self._write_commit_index(commits)
+
   def is_commit(self, commit_id: str):
     ''' return True if commit_id has a commit '''
     return self.get_commit(commit_id) is not None
@@ -381,18 +510,16 @@ class RitResource:
       self._populate_commit_to_branch_map()
     return self._commit_id_to_branch_names
 
-  def get_commit_tree(self):
+  def get_sorted_commit_ids(self):
     '''
-    returns a map of shortened commit prefixes to a list of all commit ids with
-    that prefix
+    returns all commit ids in sorted order
 
-    the tree is used to find full commit ids given partial ones.
+    commit ids sharing a prefix are adjacent, so full commit ids can be found
+    from partial ones with a binary search.
     '''
-    if self._short_commit_tree is None:
-      self._short_commit_tree = defaultdict(list)
-      for commit_id in self.get_commit_ids():
-        self._short_commit_tree[commit_id[:short_hash_index]].append(commit_id)
-    return self._short_commit_tree
+    if self._sorted_commit_ids is None:
+      self._sorted_commit_ids = sorted(self.get_commit_ids())
+    return self._sorted_commit_ids
 
   ''' helpers '''
 
@@ -421,7 +548,12 @@ class RitResource:
   ''' IO '''
 
   def _read_paths(self):
-    root_rit_dir = os.path.realpath(self.root_rit_dir)
+    # abspath doesn't touch the filesystem, unlike realpath which lstats every
+    # path component, so it's the cache key
+    search_dir = os.path.abspath(self.root_rit_dir)
+    if search_dir in rit_paths_cache:
+      return rit_paths_cache[search_dir]
+    root_rit_dir = os.path.realpath(search_dir)
     rit_dir = os.path.join(root_rit_dir, rit_dir_name)
     last_root_rit_dir = None
     while not os.path.isdir(rit_dir):
@@ -430,30 +562,72 @@ class RitResource:
       if last_root_rit_dir == root_rit_dir:
         raise RitError("Unable to locate rit directory")
       rit_dir = os.path.join(root_rit_dir, rit_dir_name)
-    return RitPaths.build_rit_paths(root_rit_dir)
+    paths = RitPaths.build_rit_paths(root_rit_dir)
+    rit_paths_cache[search_dir] = paths
+    return paths
+
+  def _commit_path(self, commit_id: str):
+    # concatenated rather than os.path.join-ed, these are built once per commit read
+    return self.paths.commits + os.sep + commit_id
+
+  def _branch_path(self, name: str):
+    return self.paths.branches + os.sep + name
 
   def _read_head(self):
     try:
-      with open(os.path.join(self.paths.rit_dir, head_ref_name)) as fin:
-        return HeadNode(**json.load(fin))
+      return HeadNode(**json_loads(read_small_file(os.path.join(self.paths.rit_dir, head_ref_name))))
     except FileNotFoundError:
       return HeadNode(None, default_branch_name)
 
   def _read_commit(self, commit_id: str):
     logger.debug("Reading commit: %s", commit_id)
-    with open(os.path.join(self.paths.commits, commit_id)) as fin:
-      return Commit(**dict(**json.load(fin), commit_id=commit_id))
+    data = json_loads(read_small_file(self._commit_path(commit_id)))
+    return Commit(**dict(**data, commit_id=commit_id))
 
   def _write_commit(self, commit: Commit):
     logger.debug("Writing commit: %s", commit.commit_id)
-    with open(os.path.join(self.paths.commits, commit.commit_id), 'w') as fout:
-      data = asdict(commit)
-      del data['commit_id']
-      json.dump(data, fout)
+    with open(self._commit_path(commit.commit_id), 'wb') as fout:
+      fout.write(json_dumps(commit_record(commit)))
+
+  def _read_commit_index(self):
+    try:
+      with open(os.path.join(self.paths.rit_dir, commit_index_name), 'rb') as fin:
+        index = json_loads(fin.read())
+    except FileNotFoundError:
+      return {}
+    except ValueError:
+      # the index is only a cache, so a truncated or corrupt one is rebuilt
+      logger.debug("Ignoring unreadable commit index")
+      return {}
+    if not isinstance(index, dict):
+      return {}
+    return index
+
+  def _write_commit_index(self, commits: dict[str, Commit]):
+    logger.debug("Writing commit index of %d commits", len(commits))
+    index = {commit_id: commit_record(commit) for commit_id, commit in commits.items()}
+    index_path = os.path.join(self.paths.rit_dir, commit_index_name)
+    tmp_index_path = None
+    try:
+      # a unique temp file, so concurrent writers don't replace each other's
+      fd, tmp_index_path = tempfile.mkstemp(dir=self.paths.work, prefix=commit_index_name)
+      with open(fd, 'wb') as fout:
+        fout.write(json_dumps(index))
+      os.replace(tmp_index_path, index_path)
+    except OSError as exc:
+      # the index is only a cache, the next mutation tries again
+      logger.debug("Unable to write commit index: %s", exc)
+      if tmp_index_path is not None:
+        try:
+          os.remove(tmp_index_path)
+        except OSError:
+          pass
+      return
+    self._commit_index_stale = False
 
   def _delete_commit(self, commit_id: str):
     try:
-      os.remove(os.path.join(self.paths.commits, commit_id))
+      os.remove(self._commit_path(commit_id))
     except FileNotFoundError:
       raise RitError("Failed to remove commit since it didn't exist: %s", commit_id)
 
@@ -469,43 +643,93 @@ class RitResource:
 
   def _read_branch(self, name: str):
     logger.debug("Reading branch: %s", name)
-    with open(os.path.join(self.paths.branches, name)) as fin:
-      branch = json.load(fin)
-      return Branch(**dict(**branch, name=name))
+    branch = json_loads(read_small_file(self._branch_path(name)))
+    return Branch(**dict(**branch, name=name))
 
   def _write_branch(self, branch: Branch):
     logger.debug("Writing branch %s to %s", branch.name, branch.commit_id)
-    if self.is_commit(branch.name):
+    # only existence matters here, so skip reading and parsing the commit
+    if branch.name in self._commits or os.path.lexists(self._commit_path(branch.name)):
       raise RitError('Not creating a branch with the same name as a commit id: %s', branch.name)
-    data = asdict(branch)
-    del data['name']
-    with open(os.path.join(self.paths.branches, branch.name), 'w') as fout:
-      json.dump(data, fout)
+    data = {'commit_id': branch.commit_id}
+    with open(self._branch_path(branch.name), 'wb') as fout:
+      fout.write(json_dumps(data))
+
+  def _delete_branch(self, name: str):
+    logger.debug("Deleting branch: %s", name)
+    try:
+      os.remove(self._branch_path(name))
+    except FileNotFoundError:
+      raise RitError("Failed to remove branch since it didn't exist.")
 
   def _read_branch_names(self):
-    for _, _, branch_names in os.walk(self.paths.branches):
-      return branch_names
-    return []
+    return list_file_names(self.paths.branches)
 
   def _read_commit_ids(self):
-    for _, _, commit_ids in os.walk(self.paths.commits):
-      return commit_ids
-    return []
+    return list_file_names(self.paths.commits)
 
   def _write_head(self, head: HeadNode):
-    with open(os.path.join(self.paths.rit_dir, head_ref_name), 'w') as fout:
-      json.dump(asdict(head), fout)
+    with open(os.path.join(self.paths.rit_dir, head_ref_name), 'wb') as fout:
+      fout.write(json_dumps({'commit_id': head.commit_id, 'branch_name': head.branch_name}))
 
 
 ''' UTIL '''
 
-def colorize(color: int, msg: str):
-  reset_seq = "\033[0m"
-  color_seq = "\033[1;{}m"
+def json_loads(data: bytes):
+  ''' parse json, using orjson if it's installed '''
+  if orjson is not None:
+    return orjson.loads(data)
+  return json.loads(data)
+
+def json_dumps(obj) -> bytes:
+  ''' serialize obj to json, using orjson if it's installed '''
+  if orjson is not None:
+    return orjson.dumps(obj)
+  return json.dumps(obj).encode('utf-8')
+
+def read_small_file(path: str):
+  '''
+  read all of path with bare os.read calls
 
-  color_section = color_seq + "{}" + reset_seq
+  skips the buffered file object open() builds, which costs more than the read
+  for the tiny commit, branch and head files
+  '''
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    data = os.read(fd, small_file_read_size)
+    if len(data) < small_file_read_size:
+      return data
+    chunks = [data]
+    while data:
+      data = os.read(fd, small_file_read_size)
+      chunks.append(data)
+    return b''.join(chunks)
+  finally:
+    os.close(fd)
+
+def commit_record(commit: Commit):
+  ''' the fields of commit that are persisted, the commit id is the file name '''
+  return {
+    'parent_commit_id': commit.parent_commit_id,
+    'create_time': commit.create_time,
+    'msg': commit.msg,
+  }
+
+def list_file_names(path: str):
+  ''' list the names of the files directly in path, [] if path doesn't exist '''
+  try:
+    with os.scandir(path) as entries:
+      return [entry.name for entry in entries if entry.is_file()]
+  except FileNotFoundError:
+    return []
 
-  return color_section.format(color, msg)
+def colorize(color: int, msg: str):
+  if not use_color:
+    return msg
+  color_seq = color_seqs.get(color)
+  if color_seq is None:
+    color_seq = "\033[1;{}m".format(color)
+  return color_seq + msg + reset_seq
 
 def mkdir(*args, exists_ok=False, **kwargs):
   try:
@@ -532,6 +756,13 @@ def optional_t(obj_t):
       return obj_t(obj)
   return optional_type
 
+def tuple_t(*obj_ts):
+  def tuple_type(obj):
+    if isinstance(obj, tuple) and len(obj) == len(obj_ts):
+      return all(obj_t(val) for obj_t, val in zip(obj_ts, obj))
+    return False
+  return tuple_type
+
 def list_t(obj_t):
   def list_type(obj):
     if isinstance(obj, list):
@@ -539,16 +770,18 @@ def list_t(obj_t):
     return False
   return list_type
 
+# validators shared by the api functions, so they aren't rebuilt per call
+str_t = exact_t(str)
+bool_t = exact_t(bool)
+optional_str_t = optional_t(str_t)
+str_list_t = list_t(str_t)
+branch_updates_t = list_t(tuple_t(str_t, optional_str_t, bool_t, bool_t))
+
 def check_types(**type_defs):
   for name, (obj, type_def) in type_defs.items():
     if not type_def(obj):
       raise TypeError(f"Element had invalid type: {name}: {type(obj)}")
 
-def check_obj_types(obj, type_defs):
-  objs = {}
-  for key, type_def in type_defs.items():
-    objs[key] = (getattr(obj, key), type_def)
-
 def require(statement, msg, *args):
   if not statement:
     raise RitError(msg, *args)
@@ -558,19 +791,67 @@ def require(statement, msg, *args):
 
 def get_tar_path(rit: RitResource, commit_id: str):
   ''' get a commit's tar path, where the backup for that commit is '''
-  return os.path.join(rit.paths.backups, commit_id + '.tar')
+  return rit.paths.backups + os.sep + commit_id + '.tar'
 
 def get_snar_path(rit: RitResource, commit_id: str):
   ''' get a commit's star path, where the backup's metadata for that commit is '''
-  return os.path.join(rit.paths.backups, commit_id + '.snar')
+  return rit.paths.backups + os.sep + commit_id + '.snar'
 
 
 ''' COMMIT HELPERS '''
 
-def hash_commit(create_time: float, msg: str, snar: str, tar: str):
-  ''' create a commit_id from '''
+def copy_snar(src: str, dst: str):
+  '''
+  copy a snar so tar can update the copy
+
+  a reflink shares the blocks on filesystems that support it (btrfs, xfs).
+  otherwise, copy_file_range copies within the kernel, and shutil is the last
+  resort. a hardlink doesn't work since tar rewrites the snar in place.
+  '''
+  with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+    if fcntl is not None:
+      try:
+        fcntl.ioctl(fout.fileno(), ficlone_request, fin.fileno())
+        return
+      except OSError:
+        pass
+    if hasattr(os, 'copy_file_range'):
+      try:
+        while os.copy_file_range(fin.fileno(), fout.fileno(), hash_chunk_size):
+          pass
+        return
+      except OSError:
+        # e.g., unsupported by the filesystem, restart the copy from the top
+        fin.seek(0)
+        fout.seek(0)
+        fout.truncate()
+    shutil.copyfileobj(fin, fout)
+
+def hash_file(path: str):
+  ''' return the sha256 digest of the contents of path '''
+  with open(path, 'rb', buffering=0) as fin:
+    if hasattr(hashlib, 'file_digest'):
+      return hashlib.file_digest(fin, 'sha256').digest()
+    file_hash = hashlib.sha256()
+    buffer = memoryview(bytearray(hash_chunk_size))
+    while True:
+      size = fin.readinto(buffer)
+      if not size:
+        break
+      file_hash.update(buffer[:size])
+  return file_hash.digest()
+
+def hash_commit(create_time: float, msg: str, snar: str, tar_digest: bytes):
+  '''
+  create a commit_id from
+
+  the tar's sha256 digest is passed in since it's computed while the tar is
+  written, see create_commit
+  '''
   logger.debug("Calculating the hash of ref")
-  ref_hash = hashlib.sha1()
+  snar_digest = hash_file(snar)
+
+  ref_hash = hashlib.sha256()
 
   ref_hash.update(b'create_time')
   ref_hash.update(str(create_time).encode('utf-8'))
@@ -579,33 +860,155 @@ def hash_commit(create_time: float, msg: str, snar: str, tar: str):
   ref_hash.update(msg.encode('utf-8'))
 
   ref_hash.update(b'snar')
-  with open(snar, 'rb') as fin:
-    ref_hash.update(fin.read())
+  ref_hash.update(snar_digest)
 
   ref_hash.update(b'tar')
-  with open(tar, 'rb') as fin:
-    ref_hash.update(fin.read())
+  ref_hash.update(tar_digest)
 
   return ref_hash.hexdigest()
 
+@functools.lru_cache(maxsize=None)
 def check_tar():
-  ''' verify tar is the correct version and GNU '''
+  '''
+  verify tar is the correct version and GNU, only checked once per process
+
+  set RIT_SKIP_TAR_CHECK=1 to skip the check, e.g., in CI where tar is known
+  '''
+  if os.environ.get('RIT_SKIP_TAR_CHECK') == '1':
+    return
   logger.debug("Checking tar version")
-  process = subprocess.Popen(['tar', '--version'], stdout=subprocess.PIPE)
-  contents = process.stdout.read()
-  process.wait()
+  contents = subprocess.run(['tar', '--version'], stdout=subprocess.PIPE).stdout
   version = contents.decode('utf-8').split('\n', 1)[0]
   logger.debug("Tar Version: %s", version)
   assert 'GNU tar' in version, "You must have a GNU tar installed"
 
+@functools.lru_cache(maxsize=None)
+def get_compress_opts():
+  '''
+  tar options to compress new backups with, multithreaded zstd if it's
+  installed, otherwise gzip
+
+  extracting doesn't need these since tar detects the compression itself
+  '''
+  if shutil.which('zstd') is not None:
+    return ['--use-compress-program=zstd -T0 -3']
+  return ['-z']
+
+def iter_pipe_lines(pipe):
+  '''
+  yield the lines of pipe without their newlines
+
+  reads in large chunks and splits them in bulk rather than a readline per line
+  '''
+  fd = pipe.fileno()
+  remainder = b''
+  while True:
+    chunk = os.read(fd, pipe_chunk_size)
+    if not chunk:
+      break
+    lines = (remainder + chunk).split(b'\n')
+    remainder = lines.pop()
+    yield from lines
+  if remainder:
+    yield remainder
+
+def read_snar(snar: str):
+  '''
+  parse a GNU tar incremental snapshot (format 2)
+
+  returns the snapshot time in ns and a dict mapping each directory name (e.g.,
+  b'./sub') to its (dev, ino, entry names), or None if the format isn't known
+  '''
+  with open(snar, 'rb') as fin:
+    header = fin.readline()
+    fields = fin.read().split(b'\0')
+  if not header.startswith(b'GNU tar-') or not header.endswith(b'-2\n'):
+    return None
+
+  snapshot_ns = int(fields[0]) * 1_000_000_000 + int(fields[1])
+  dirs = {}
+  idx = 2
+  while idx + 6 <= len(fields):
+    _nfs, _mtime_sec, _mtime_nsec, dev, ino, name = fields[idx:idx + 6]
+    idx += 6
+    names = set()
+    while fields[idx]:
+      names.add(fields[idx][1:])
+      idx += 1
+    # skip the empty entry ending the dumpdir and the record terminator
+    idx += 2
+    names.discard(rit_dir_name.encode())
+    dirs[name] = (int(dev), int(ino), names)
+  return snapshot_ns, dirs
+
+def iter_tree_changes(root: str, snar_index):
+  '''
+  yield the names (e.g., b'./sub/file') of entries in root that changed relative
+  to snar_index, as returned by read_snar
+
+  A metadata only walk: a file is changed if its mtime or ctime is not older
+  than the snapshot, which is the test tar uses. A directory is changed if that
+  holds for it, if it's new or replaced, or if its entry names differ, i.e.,
+  something was added or removed directly in it. tar lists every directory in
+  an incremental dump, changed or not, so unchanged directories aren't changes
+  here.
+  '''
+  snapshot_ns, dirs = snar_index
+  rit_dir_name_b = rit_dir_name.encode()
+
+  def changed(st: os.stat_result):
+    return st.st_mtime_ns >= snapshot_ns or st.st_ctime_ns >= snapshot_ns
+
+  root_b = os.fsencode(root)
+  pending = [(b'.', os.lstat(root_b))]
+  while pending:
+    name, st = pending.pop()
+    record = dirs.get(name)
+    dir_changed = record is None or changed(st) or st.st_dev != record[0] or st.st_ino != record[1]
+
+    found = set()
+    with os.scandir(os.path.join(root_b, name)) as entries:
+      for entry in entries:
+        if entry.name == rit_dir_name_b:
+          continue
+        found.add(entry.name)
+        entry_st = entry.stat(follow_symlinks=False)
+        if entry.is_dir(follow_symlinks=False):
+          pending.append((name + b'/' + entry.name, entry_st))
+        elif changed(entry_st):
+          yield name + b'/' + entry.name
+    if dir_changed or found != record[2]:
+      yield name
+
+def tree_changed_since_snar(root: str, snar: str):
+  '''
+  returns True if root has changes relative to snar, as iter_tree_changes
+  finds them, or None if the snar couldn't be read
+  '''
+  snar_index = read_snar(snar)
+  if snar_index is None:
+    return None
+  return next(iter_tree_changes(root, snar_index), None) is not None
+
 def status_tar(rit: RitResource, verbose: bool):
   ''' returns True if rit directory is dirty '''
   parent_commit_id = rit.get_head_commit_id()
+  # the metadata walk decides whether the tree is dirty, tar only lists it
+  tree_changes = None
+  if parent_commit_id is not None:
+    snar_index = read_snar(get_snar_path(rit, parent_commit_id))
+    if snar_index is not None:
+      if not verbose:
+        return next(iter_tree_changes(rit.paths.root, snar_index), None) is not None
+      tree_changes = set(iter_tree_changes(rit.paths.root, snar_index))
+      if not tree_changes:
+        return False
+
   work_snar = os.path.join(rit.paths.work, 'ref.snar')
   if parent_commit_id is not None:
     head_snar = get_snar_path(rit, parent_commit_id)
     # TODO: move into rit resource
-    shutil.copyfile(head_snar, work_snar)
+    copy_snar(head_snar, work_snar)
 
   check_tar()
   tar_cmd = ['tar', '-cvg', work_snar, f'--exclude={rit_dir_name}', '-f', os.devnull, '.']
@@ -615,18 +1018,19 @@ def status_tar(rit: RitResource, verbose: bool):
   process = subprocess.Popen(tar_cmd, cwd=rit.paths.root, stdout=subprocess.PIPE)
   terminated = False
   dirty = False
-  while True:
-    line = process.stdout.readline()
-    if not line:
-      break
-
-    if line == b'./\n':
+  log_changes = logger.isEnabledFor(logging.INFO)
+  for line in iter_pipe_lines(process.stdout):
+    if tree_changes is None:
+      if line == b'./':
+        continue
+    elif line.endswith(b'/') and line[:-1] not in tree_changes:
       continue
 
     dirty = True
     if verbose:
-      output = line.decode('utf-8').strip()
-      logger.info("\t- %s", colorize(fg + red, output))
+      if log_changes:
+        output = line.decode('utf-8').strip()
+        logger.info("\t- %s", colorize(fg + red, output))
     else:
       terminated = True
       try:
@@ -645,7 +1049,7 @@ def status_tar(rit: RitResource, verbose: bool):
     raise RitError("Creating commit's tar failed with exit code: %d", exit_code)
 
   os.remove(work_snar)
-  return dirty
+  return dirty or bool(tree_changes)
 
 def create_commit(rit: RitResource, create_time: float, msg: str):
   ''' create a commit with the current head as the parent commit (if any) '''
@@ -662,25 +1066,36 @@ def create_commit(rit: RitResource, create_time: float, msg: str):
     head_snar = get_snar_path(rit, parent_commit_id)
     logger.debug("Copying previous snar: %s", head_snar)
     # TODO: move into rit resource
-    shutil.copyfile(head_snar, work_snar)
+    copy_snar(head_snar, work_snar)
   else:
     logger.debug("Using fresh snar file since no parent commit")
 
   check_tar()
-  opts = '-cz'
+  opts = '-c'
   if logger.getEffectiveLevel() <= logging.DEBUG:
+    # tar sends the listing to stderr since the archive goes to stdout
     opts += 'v'
   opts += 'g'
-  tar_cmd = ['tar', opts, work_snar, f'--exclude={rit_dir_name}', '-f', work_tar, '.']
+  tar_cmd = ['tar', opts, work_snar, *get_compress_opts(), f'--exclude={rit_dir_name}', '-f', '-', '.']
   logger.debug("Running tar command: %s", tar_cmd)
-  # TODO: move into rit resource
-  process = subprocess.Popen(tar_cmd, cwd=rit.paths.root)
-  # TODO: doesn't forward SIGTERM, only SIGINT
-  exit_code = process.wait()
+  # the tar is hashed as it's written rather than read back from disk after
+  tar_hash = hashlib.sha256()
+  with open(work_tar, 'wb') as fout:
+    # TODO: move into rit resource
+    process = subprocess.Popen(tar_cmd, cwd=rit.paths.root, stdout=subprocess.PIPE)
+    fd = process.stdout.fileno()
+    while True:
+      chunk = os.read(fd, hash_chunk_size)
+      if not chunk:
+        break
+      tar_hash.update(chunk)
+      fout.write(chunk)
+    # TODO: doesn't forward SIGTERM, only SIGINT
+    exit_code = process.wait()
   if exit_code != 0:
     raise RitError("Creating commit's tar failed with exit code: %d", exit_code)
 
-  commit_id = hash_commit(create_time, msg, work_snar, work_tar)
+  commit_id = hash_commit(create_time, msg, work_snar, tar_hash.digest())
 
   logger.debug("Moving working snar into backups directory")
   snar = get_snar_path(rit, commit_id)
@@ -715,7 +1130,7 @@ def apply_commit(rit: RitResource, commit: Commit):
   tar_file = get_tar_path(rit, commit.commit_id)
   tar_cmd = ['tar', '-xg', os.devnull, '-f', tar_file]
   # rit resource thing?
-  process = subprocess.Popen(tar_cmd, cwd=rit.paths.root)
+  process = subprocess.Popen(tar_cmd, cwd=rit.paths.root, stdout=subprocess.DEVNULL)
   exit_code = process.wait()
   if exit_code != 0:
     raise RitError("Failed while trying to apply commit: %s", commit.commit_id)
@@ -741,7 +1156,7 @@ def restore_to_commit(rit: RitResource, commit: Commit):
 
 ''' BRANCH HELPERS '''
 
-@dataclass
+@dataclass(**struct_opts)
 class ResolvedRef:
   '''
   the user provides a ref, which can reference head, a branch or commit. this
@@ -797,19 +1212,18 @@ def resolve_commit(rit: RitResource, partial_commit_id: str):
     return commit
   if len(partial_commit_id) < short_hash_index:
     return None
-  short_commit_id = partial_commit_id[:short_hash_index]
-  commit_tree = rit.get_commit_tree()
-  if short_commit_id not in commit_tree:
-    return None
+  sorted_commit_ids = rit.get_sorted_commit_ids()
   commit = None
-  for commit_id in commit_tree[short_commit_id]:
-    size = len(partial_commit_id)
-    if partial_commit_id == commit_id[:size]:
-      if commit is not None:
-        raise RitError("Reference %s matched commits %s and %s", partial_commit_id, commit.commit_id, commit_id)
-      commit = rit.get_commit(commit_id, ensure=True)
+  idx = bisect.bisect_left(sorted_commit_ids, partial_commit_id)
+  while idx < len(sorted_commit_ids) and sorted_commit_ids[idx].startswith(partial_commit_id):
+    commit_id = sorted_commit_ids[idx]
+    if commit is not None:
+      raise RitError("Reference %s matched commits %s and %s", partial_commit_id, commit.commit_id, commit_id)
+    commit = rit.get_commit(commit_id, ensure=True)
+    idx += 1
   return commit
 
+full_commit_id_re = re.compile('[0-9a-f]{40}|[0-9a-f]{64}')
 def resolve_ref(rit: RitResource, ref: Optional[str]):
   '''
   resolve a user provided reference
@@ -825,6 +1239,8 @@ def resolve_ref(rit: RitResource, ref: Optional[str]):
   see the def of ResolvedRef
   '''
   logger.debug("Resolving ref: %s", ref)
+  if ref in rit._resolved_refs:
+    return rit._resolved_refs[ref]
   res = ResolvedRef()
   if ref is None or ref == head_ref_name:
     head = rit.head
@@ -836,12 +1252,16 @@ def resolve_ref(rit: RitResource, ref: Optional[str]):
         res.commit = rit.get_commit(res.branch.commit_id)
     else:
       res.commit = rit.get_commit(head.commit_id)
+  elif full_commit_id_re.fullmatch(ref) and rit.is_commit(ref):
+    # a branch can't be named after an existing commit, see _write_branch
+    res.commit = rit.get_commit(ref)
   else:
     res.branch = rit.get_branch(ref)
     if res.branch is not None:
       res.commit = rit.get_commit(res.branch.commit_id)
     else:
       res.commit = resolve_commit(rit, ref)
+  rit._resolved_refs[ref] = res
   return res
 
 def resolve_refs(rit: RitResource, refs: list[str], all: bool):
@@ -854,33 +1274,41 @@ def resolve_refs(rit: RitResource, refs: list[str], all: bool):
     refs.append(None)
   if all:
     refs.extend(rit.get_branch_names())
+    # fill the branch cache in bulk so each resolve is a lookup
+    rit.get_branch_name_to_commit_ids()
   for ref in refs:
     res = resolve_ref(rit, ref)
     resolved_refs.append(res)
 
   return resolved_refs
 
-branch_name_re = re.compile('^\\w+$')
+branch_name_re = re.compile('\\w+')
 def validate_branch_name(name: str):
   ''' return whether this string is a valid branch name '''
   if name == head_ref_name:
     raise RitError("Branch can't be named the same as the head ref: %s", name)
-  elif branch_name_re.search(name) is None:
+  elif branch_name_re.fullmatch(name) is None:
     raise RitError("Invalid branch name: %s", name)
 
 def _pprint_dur(dur: int, name: str):
   return f"{dur} {name}{'s' if dur > 1 else ''}"
 
+def _month_index(timestamp: float):
+  ''' months since year 0 in local time, for calendar month differences '''
+  tm = time.localtime(timestamp)
+  return 12 * tm.tm_year + tm.tm_mon
+
+# log passes the same end time for every commit
+_end_month_index = functools.lru_cache(maxsize=1)(_month_index)
+
 def pprint_time_duration(start: float, end: float):
   ''' pretty print a time duration '''
-  start_dt = datetime.datetime.fromtimestamp(start)
-  end_dt = datetime.datetime.fromtimestamp(end)
   dur = end - start
   dur_sec = dur
   dur_min = dur / 60
   dur_hour = dur_min / 60
   dur_day = dur_hour / 24
-  dur_month = 12 * (end_dt.year - start_dt.year) + (end_dt.month - start_dt.month)
+  dur_month = _end_month_index(end) - _month_index(start)
   dur_year = dur_month // 12
 
   parts = []
@@ -914,23 +1342,39 @@ def log_commits(rit: RitResource, commits: list[Commit]):
   - commit_id_to_commit: a map of each commit to a full Commit object
   - commit_id_to_branch_names: a map of each commit_id to branch names, including the head_ref_name
   '''
+  if commits:
+    # one index read instead of a commit file per ancestor walked below
+    rit.load_commits()
+
   leafs: set[str] = set()
   commit_graph: dict[str, str] = {}
   for commit in commits:
-    if commit.commit_id not in commit_graph:
-      leafs.add(commit.commit_id)
+    if commit.commit_id in commit_graph:
+      continue
+    leafs.add(commit.commit_id)
     while True:
       commit_graph[commit.commit_id] = commit.parent_commit_id
       if commit.parent_commit_id is None:
         break
-      parent_commit = rit.get_commit(commit.parent_commit_id, ensure=True)
-      if parent_commit.commit_id in leafs:
-        leafs.remove(parent_commit.commit_id)
-
-      commit = parent_commit
+      if commit.parent_commit_id in commit_graph:
+        # the rest of the ancestry was walked from an earlier commit
+        leafs.discard(commit.parent_commit_id)
+        break
+      commit = rit.get_commit(commit.parent_commit_id, ensure=True)
 
   now = time.time()
   commit_id_to_branch_names = rit.get_commit_id_to_branch_names()
+  # branch labels are colored once, not every time a branch's commit is logged
+  commit_id_to_branch_details: dict[str, str] = {}
+  for branch_commit_id, branch_names in commit_id_to_branch_names.items():
+    colored_branch_names = []
+    for branch_name in branch_names:
+      if branch_name == head_ref_name:
+        colored_branch_names.append(colorize(fg + blue, branch_name))
+      else:
+        colored_branch_names.append(colorize(fg + green, branch_name))
+    commit_id_to_branch_details[branch_commit_id] = f"({', '.join(colored_branch_names)}) "
+
   commit_id_to_commit: dict[str, Commit] = {}
   for commit_id in leafs:
     logger.info("Log branch from %s", commit_id[:short_hash_index])
@@ -941,17 +1385,7 @@ def log_commits(rit: RitResource, commits: list[Commit]):
 
       colored_commit_id = colorize(fg + yellow, commit.commit_id[:short_hash_index])
 
-      if commit.commit_id in commit_id_to_branch_names:
-        branch_names = commit_id_to_branch_names[commit.commit_id]
-        colored_branch_names = []
-        for branch_name in branch_names:
-          if branch_name == head_ref_name:
-            colored_branch_names.append(colorize(fg + blue, branch_name))
-          else:
-            colored_branch_names.append(colorize(fg + green, branch_name))
-        branch_details = f"({', '.join(colored_branch_names)}) "
-      else:
-        branch_details = ''
+      branch_details = commit_id_to_branch_details.get(commit.commit_id, '')
 
       time_duration = pprint_time_duration(commit.create_time, now)
       date_details = f'({time_duration}) '
@@ -964,21 +1398,25 @@ def log_commits(rit: RitResource, commits: list[Commit]):
 
 def delete_branch(rit: RitResource, name: str):
   ''' removes a branch '''
-  try:
-    os.remove(os.path.join(rit.paths.branches, name))
-  except FileNotFoundError:
-    raise RitError("Failed to remove branch since it didn't exist.")
+  rit.remove_branch(name)
+
+def delete_branches(rit: RitResource, names: list[str]):
+  ''' removes several branches '''
+  rit.remove_branches(names)
 
 def list_branches(rit: RitResource):
   ''' logs branches to logger '''
   head = rit.head
   head_branch_name = head.branch_name
   branch_names = rit.get_branch_names()
+  log_branches = logger.isEnabledFor(logging.INFO)
   # TODO: this doesn't handle HEAD well if its commitless
   for branch_name in branch_names:
-    this_sym = '*' if branch_name == head_branch_name else ' '
     branch = rit.get_branch(branch_name, ensure=True)
     commit = rit.get_commit(branch.commit_id, ensure=True)
+    if not log_branches:
+      continue
+    this_sym = '*' if branch_name == head_branch_name else ' '
     colored_commit_id = colorize(fg + yellow, branch.commit_id[:short_hash_index])
     colored_branch_name = colorize(fg + green, branch_name)
     logger.info("%s %s\t%s %s", this_sym, colored_branch_name, colored_commit_id, commit.msg)
@@ -1005,6 +1443,36 @@ def create_branch(rit: RitResource, name: str, ref: Optional[str], force: bool):
   logger.info("Created branch %s at %s", name, commit_id[:short_hash_index])
   return res
 
+def update_branch(rit: RitResource, name: Optional[str], ref: Optional[str], force: bool, delete: bool):
+  '''
+  deletes, lists or creates branches depending on the arguments
+
+  see branch_cmd
+  '''
+  if name is not None:
+    validate_branch_name(name)
+
+  if delete:
+    if force:
+      raise RitError("You can't force delete branches")
+    elif name is None:
+      raise RitError("You must specify a branch to delete")
+    elif ref is not None:
+      raise RitError("You can't specify a reference branch with the delete option")
+
+    delete_branch(rit, name)
+
+  elif name is None:
+    if force:
+      raise RitError("You cannot specify force while listing branches")
+    elif ref is not None:
+      raise RitError("You cannot specify a ref branch while listing branches")
+
+    return list_branches(rit)
+
+  else:
+    return create_branch(rit, name, ref, force)
+
 def log_refs(rit: RitResource, refs: list[str], all: bool, full: bool):
   '''
   Returns the commit tree containing the given refs. If none are given, assumes
@@ -1012,12 +1480,8 @@ def log_refs(rit: RitResource, refs: list[str], all: bool, full: bool):
   '''
   commits = []
 
-  if not refs:
-    refs.append(None)
-  if all:
-    refs.extend(rit.get_branch_names())
-  for ref in refs:
-    res = resolve_ref(rit, ref)
+  resolved_refs = resolve_refs(rit, refs, all)
+  for ref, res in zip(refs, resolved_refs):
     if res.commit is None:
       if res.head is not None:
         # TODO: this doesn't handle HEAD well if its commitless
@@ -1041,15 +1505,14 @@ def show_ref(rit: RitResource, ref: Optional[str]):
   tar_cmd = ['tar', '-tf', tar_file]
   process = subprocess.Popen(tar_cmd, stdout=subprocess.PIPE)
   changes = []
-  while True:
-    line = process.stdout.readline()
-    if not line:
-      break
-    elif line == b'./\n':
+  log_changes = logger.isEnabledFor(logging.INFO)
+  for line in iter_pipe_lines(process.stdout):
+    if line == b'./':
       continue
-    output = line.decode('utf-8').strip()
+    output = line.decode('utf-8')
     changes.append(output)
-    logger.info("\t- %s", colorize(fg + cyan, output))
+    if log_changes:
+      logger.info("\t- %s", colorize(fg + cyan, output))
   results = process.wait()
   if results != 0:
     raise RitError("tar command failed with exit code %d", results)
@@ -1094,8 +1557,8 @@ def checkout_ref(*, root_rit_dir: str, ref: str, force: bool):
   logger.debug('  ref: %s', ref)
   logger.debug('  force: %s', force)
   check_types(
-    ref = (ref, exact_t(str)),
-    force = (force, exact_t(bool)),
+    ref = (ref, str_t),
+    force = (force, bool_t),
   )
 
   rit = RitResource(root_rit_dir)
@@ -1118,7 +1581,8 @@ def checkout_ref(*, root_rit_dir: str, ref: str, force: bool):
     new_head = HeadNode(branch_name = res.branch.name)
   else:
     new_head = HeadNode(commit_id = commit.commit_id)
-  rit.set_head(new_head)
+  if rit.head != new_head:
+    rit.set_head(new_head)
 
   if restored:
     logger.info("Successful checkout. Commit this checkout to get a clean rit status.")
@@ -1138,7 +1602,7 @@ def checkout_orphan(*,
   logger.debug('checkout_orphan')
   logger.debug('  name: %s', name)
   check_types(
-    name = (name, optional_t(exact_t(str))),
+    name = (name, optional_str_t),
   )
 
   validate_branch_name(name)
@@ -1177,7 +1641,7 @@ def commit_cmd(*, root_rit_dir: str, msg: str):
   logger.debug('commit')
   logger.debug('  msg: %s', msg)
   check_types(
-    msg = (msg, exact_t(str)),
+    msg = (msg, str_t),
   )
 
   rit = RitResource(root_rit_dir)
@@ -1201,8 +1665,8 @@ def reset_cmd(*, root_rit_dir: str, ref: Optional[str], hard: bool):
   logger.debug('  ref: %s', ref)
   logger.debug('  hard: %s', hard)
   check_types(
-    ref = (ref, optional_t(exact_t(str))),
-    hard = (hard, exact_t(bool)),
+    ref = (ref, optional_str_t),
+    hard = (hard, bool_t),
   )
 
   rit = RitResource(root_rit_dir)
@@ -1243,8 +1707,8 @@ def checkout_cmd(*, root_rit_dir: str, orphan: bool, ref_or_name: str, force: Op
   logger.debug('  ref_or_name: %s', ref_or_name)
   logger.debug('  force: %s', force)
   check_types(
-    orphan = (orphan, exact_t(bool)),
-    ref_or_name = (ref_or_name, exact_t(str)),
+    orphan = (orphan, bool_t),
+    ref_or_name = (ref_or_name, str_t),
   )
   if orphan:
     check_types(
@@ -1254,6 +1718,26 @@ def checkout_cmd(*, root_rit_dir: str, orphan: bool, ref_or_name: str, force: Op
   else:
     return checkout_ref(root_rit_dir=root_rit_dir, ref=ref_or_name, force=force)
 
+def switch_branch_cmd(*, root_rit_dir: str, name: str):
+  '''
+  Move head to the existing branch name without touching the working directory.
+
+  Unlike checkout, nothing is restored, so the working directory shows up as
+  changes relative to the branch's commit, and the next commit is made on top
+  of that branch.
+  '''
+  logger.debug('switch_branch')
+  logger.debug('  name: %s', name)
+  check_types(
+    name = (name, str_t),
+  )
+  validate_branch_name(name)
+
+  rit = RitResource(root_rit_dir)
+  if not rit.is_branch(name):
+    raise RitError("Unable to switch to branch since it doesn't exist: %s", name)
+  rit.set_head(HeadNode(branch_name=name))
+
 def branch_cmd(*, root_rit_dir: str, name: Optional[str], ref: Optional[str], force: bool, delete: bool):
   '''
   ref is a ref name or commit id or head_ref_name
@@ -1267,37 +1751,53 @@ def branch_cmd(*, root_rit_dir: str, name: Optional[str], ref: Optional[str], fo
   logger.debug('  force: %s', force)
   logger.debug('  delete: %s', delete)
   check_types(
-    name = (name, optional_t(exact_t(str))),
-    ref = (ref, optional_t(exact_t(str))),
-    force = (force, exact_t(bool)),
-    delete = (delete, exact_t(bool)),
+    name = (name, optional_str_t),
+    ref = (ref, optional_str_t),
+    force = (force, bool_t),
+    delete = (delete, bool_t),
   )
 
-  if name is not None:
-    validate_branch_name(name)
-
   rit = RitResource(root_rit_dir)
+  return update_branch(rit, name, ref, force, delete)
 
-  if delete:
-    if force:
-      raise RitError("You can't force delete branches")
-    elif name is None:
-      raise RitError("You must specify a branch to delete")
-    elif ref is not None:
-      raise RitError("You can't specify a reference branch with the delete option")
+def batch_branch_cmd(*, root_rit_dir: str, updates: list[tuple[str, Optional[str], bool, bool]]):
+  '''
+  Apply several branch_cmd updates in order using a single RitResource.
 
-    delete_branch(rit, name)
+  Each update is a (name, ref, force, delete) tuple with the same meaning as
+  branch_cmd's arguments. Since listing branches isn't an update, name is
+  required.
 
-  elif name is None:
-    if force:
-      raise RitError("You cannot specify force while listing branches")
-    elif ref is not None:
-      raise RitError("You cannot specify a ref branch while listing branches")
+  Returns a list of what branch_cmd would have returned for each update.
+  '''
+  logger.debug('batch_branch')
+  logger.debug('  updates: %s', updates)
+  check_types(
+    updates = (updates, branch_updates_t),
+  )
 
-    return list_branches(rit)
+  rit = RitResource(root_rit_dir)
+  results = []
+  for name, ref, force, delete in updates:
+    results.append(update_branch(rit, name, ref, force, delete))
+  return results
 
-  else:
-    return create_branch(rit, name, ref, force)
+def delete_branches_cmd(*, root_rit_dir: str, names: list[str]):
+  '''
+  Delete every branch in names using a single RitResource. All names are
+  validated before any branch is removed.
+  '''
+  logger.debug('delete_branches')
+  logger.debug('  names: %s', names)
+  check_types(
+    names = (names, str_list_t),
+  )
+
+  for name in names:
+    validate_branch_name(name)
+
+  rit = RitResource(root_rit_dir)
+  delete_branches(rit, names)
 
 def log_cmd(*, root_rit_dir: str, refs: list[str], all: bool, full: bool):
   logger.debug('log')
@@ -1305,9 +1805,9 @@ def log_cmd(*, root_rit_dir: str, refs: list[str], all: bool, full: bool):
   logger.debug('  all: %s', all)
   logger.debug('  full: %s', all)
   check_types(
-    refs = (refs, list_t(exact_t(str))),
-    all = (all, exact_t(bool)),
-    full = (full, exact_t(bool)),
+    refs = (refs, str_list_t),
+    all = (all, bool_t),
+    full = (full, bool_t),
   )
 
   rit = RitResource(root_rit_dir)
@@ -1316,7 +1816,7 @@ def log_cmd(*, root_rit_dir: str, refs: list[str], all: bool, full: bool):
 def show_cmd(*, root_rit_dir: str, ref: Optional[str]):
   logger.debug('show')
   logger.debug('  ref: %s', ref)
-  check_types(ref = (ref, optional_t(exact_t(str))))
+  check_types(ref = (ref, optional_str_t))
 
   rit = RitResource(root_rit_dir)
   return show_ref(rit, ref)
@@ -1424,6 +1924,10 @@ def setup_logger(verbose: int):
 
   logging.basicConfig(level=level, format=format)
 
+  # escape codes are noise when the output is piped or redirected to a file
+  global use_color
+  use_color = sys.stderr.isatty()
+
   logging.addLevelName(logging.DEBUG, colorize(fg + blue, logging.getLevelName(logging.DEBUG)[0]))
   logging.addLevelName(logging.INFO, colorize(fg + green, logging.getLevelName(logging.INFO)[0]))
   logging.addLevelName(logging.WARNING, colorize(fg + yellow, logging.getLevelName(logging.WARNING)[0]))
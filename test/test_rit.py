@@ -1,7 +1,9 @@
 import os
+import logging
+import tempfile
 
 # public api
-from rit_lib import init_cmd, commit_cmd, reset_cmd, checkout_cmd, branch_cmd, log_cmd, show_cmd, status_cmd, prune_cmd, query_cmd
+from rit_lib import init_cmd, commit_cmd, reset_cmd, checkout_cmd, switch_branch_cmd, branch_cmd, batch_branch_cmd, delete_branches_cmd, log_cmd, show_cmd, status_cmd, prune_cmd, query_cmd
 # advanced api
 import rit_lib
 
@@ -524,3 +526,290 @@ def test_python_api():
   rit_res = query_cmd(**base_kwargs)
   assert rit_res.head.branch_name is None
   assert rit_res.head.commit_id == head_commit
+
+def test_batch_branch_cmd():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    first_commit = commit_cmd(**base_kwargs, msg="first")
+    touch(root_rit_dir, 'second')
+    second_commit = commit_cmd(**base_kwargs, msg="second")
+
+    results = batch_branch_cmd(**base_kwargs, updates=[
+      ('batch_a', first_commit.commit_id, False, False),
+      ('batch_b', None, False, False),
+      ('batch_a', None, True, False),
+      ('batch_b', None, False, True),
+    ])
+    assert len(results) == 4
+    assert results[0].commit.commit_id == first_commit.commit_id
+    assert results[1].commit.commit_id == second_commit.commit_id
+    assert results[2].commit.commit_id == second_commit.commit_id
+    assert results[3] is None
+
+    rit_res = query_cmd(**base_kwargs)
+    assert rit_res.get_branch('batch_a').commit_id == second_commit.commit_id
+    assert rit_res.get_branch('batch_b') is None
+
+    try:
+      batch_branch_cmd(**base_kwargs, updates=[(None, None, False, False)])
+      assert False
+    except TypeError:
+      pass
+
+def test_delete_branches_cmd():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    commit_cmd(**base_kwargs, msg="first")
+    for name in ['del_a', 'del_b', 'keep']:
+      branch_cmd(**base_kwargs, name=name, ref=None, force=False, delete=False)
+
+    assert delete_branches_cmd(**base_kwargs, names=['del_a', 'del_b']) is None
+    rit_res = query_cmd(**base_kwargs)
+    assert set(rit_res.get_branch_names()) == set(['main', 'keep'])
+
+    # invalid names are rejected before anything is removed
+    try:
+      delete_branches_cmd(**base_kwargs, names=['keep', 'invalid name'])
+      assert False
+    except rit_lib.RitError:
+      pass
+    assert query_cmd(**base_kwargs).get_branch('keep') is not None
+
+    try:
+      delete_branches_cmd(**base_kwargs, names=['keep', 'missing'])
+      assert False
+    except rit_lib.RitError:
+      pass
+
+def test_switch_branch_cmd():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    first_commit = commit_cmd(**base_kwargs, msg="first")
+    branch_cmd(**base_kwargs, name='switch_target', ref=None, force=False, delete=False)
+    second_file = touch(root_rit_dir, 'second')
+    second_commit = commit_cmd(**base_kwargs, msg="second")
+
+    switch_branch_cmd(**base_kwargs, name='switch_target')
+    rit_res = query_cmd(**base_kwargs)
+    assert rit_res.head.branch_name == 'switch_target'
+    assert rit_res.get_branch('main').commit_id == second_commit.commit_id
+    # the working directory is left alone
+    assert os.path.exists(second_file)
+
+    third_commit = commit_cmd(**base_kwargs, msg="third")
+    assert third_commit.parent_commit_id == first_commit.commit_id
+
+    try:
+      switch_branch_cmd(**base_kwargs, name='missing')
+      assert False
+    except rit_lib.RitError:
+      pass
+
+    # names that aren't branch names never reach the branch files
+    for bad_name in ['../commits/' + first_commit.commit_id, rit_lib.head_ref_name]:
+      try:
+        switch_branch_cmd(**base_kwargs, name=bad_name)
+        assert False
+      except rit_lib.RitError:
+        pass
+    assert query_cmd(**base_kwargs).head.branch_name == 'switch_target'
+
+def test_tree_changed_since_snar():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    os.makedirs(os.path.join(root_rit_dir, 'sub', 'deep'))
+    touch(root_rit_dir, 'first')
+    touch(root_rit_dir, os.path.join('sub', 'second'))
+    first_commit = commit_cmd(**base_kwargs, msg="first")
+    rit_res = query_cmd(**base_kwargs)
+    snar = rit_lib.get_snar_path(rit_res, first_commit.commit_id)
+
+    # subdirectories alone don't make the tree dirty, with or without tar's listing
+    assert rit_lib.tree_changed_since_snar(root_rit_dir, snar) is False
+    assert rit_lib.status_tar(query_cmd(**base_kwargs), False) is False
+    assert rit_lib.status_tar(query_cmd(**base_kwargs), True) is False
+
+    # nested modifications, additions and deletions do
+    with open(os.path.join(root_rit_dir, 'sub', 'second'), 'w') as fout:
+      fout.write('changed')
+    assert rit_lib.tree_changed_since_snar(root_rit_dir, snar) is True
+    second_commit = commit_cmd(**base_kwargs, msg="second")
+    snar = rit_lib.get_snar_path(rit_res, second_commit.commit_id)
+    assert rit_lib.tree_changed_since_snar(root_rit_dir, snar) is False
+
+    touch(root_rit_dir, os.path.join('sub', 'deep', 'third'))
+    assert rit_lib.tree_changed_since_snar(root_rit_dir, snar) is True
+    third_commit = commit_cmd(**base_kwargs, msg="third")
+    snar = rit_lib.get_snar_path(rit_res, third_commit.commit_id)
+
+    os.remove(os.path.join(root_rit_dir, 'first'))
+    assert rit_lib.tree_changed_since_snar(root_rit_dir, snar) is True
+    assert rit_lib.status_tar(query_cmd(**base_kwargs), False) is True
+    assert rit_lib.status_tar(query_cmd(**base_kwargs), True) is True
+
+def test_load_commits():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    first_commit = commit_cmd(**base_kwargs, msg="first")
+    touch(root_rit_dir, 'second')
+    second_commit = commit_cmd(**base_kwargs, msg="second")
+
+    rit_res = rit_lib.RitResource(root_rit_dir)
+    commits = rit_res.load_commits()
+    assert commits == {
+      first_commit.commit_id: first_commit,
+      second_commit.commit_id: second_commit,
+    }
+    index_path = os.path.join(rit_res.paths.rit_dir, rit_lib.commit_index_name)
+    assert os.path.exists(index_path)
+
+    # later loads are served from the cache
+    os.remove(index_path)
+    assert rit_res.load_commits() == commits
+    assert not os.path.exists(index_path)
+
+    # reading never writes the index, only adding or removing commits does
+    assert rit_lib.RitResource(root_rit_dir).load_commits() == commits
+    log_cmd(**base_kwargs, all=True, full=False, refs=[])
+    assert not os.path.exists(index_path)
+
+    # the index is a cache, new and pruned commits are picked up
+    touch(root_rit_dir, 'third')
+    third_commit = commit_cmd(**base_kwargs, msg="third")
+    with open(index_path, 'rb') as fin:
+      assert set(rit_lib.json_loads(fin.read())) == {first_commit.commit_id, second_commit.commit_id, third_commit.commit_id}
+    branch_cmd(**base_kwargs, name='main', ref=second_commit.commit_id, force=True, delete=False)
+    reset_cmd(**base_kwargs, ref=None, hard=False)
+    assert rit_lib.RitResource(root_rit_dir).load_commits()[third_commit.commit_id] == third_commit
+    assert prune_cmd(**base_kwargs) == [third_commit.commit_id]
+    assert set(rit_lib.RitResource(root_rit_dir).load_commits()) == {first_commit.commit_id, second_commit.commit_id}
+    with open(index_path, 'rb') as fin:
+      assert set(rit_lib.json_loads(fin.read())) == {first_commit.commit_id, second_commit.commit_id}
+
+    # failing to write the index doesn't fail the command
+    def refuse_mkstemp(*args, **kwargs):
+      raise OSError("read only")
+    mkstemp = rit_lib.tempfile.mkstemp
+    rit_lib.tempfile.mkstemp = refuse_mkstemp
+    try:
+      os.remove(index_path)
+      assert prune_cmd(**base_kwargs) == []
+    finally:
+      rit_lib.tempfile.mkstemp = mkstemp
+    assert not os.path.exists(index_path)
+
+    # a corrupt index is ignored and rebuilt
+    for corrupt in [b'', b'{"trunc', b'[]', b'{"x": 1}']:
+      with open(index_path, 'wb') as fout:
+        fout.write(corrupt)
+      assert set(rit_lib.RitResource(root_rit_dir).load_commits()) == {first_commit.commit_id, second_commit.commit_id}
+      assert log_cmd(**base_kwargs, all=True, full=False, refs=[]) is not None
+      assert prune_cmd(**base_kwargs) == []
+      with open(index_path, 'rb') as fin:
+        assert set(rit_lib.json_loads(fin.read())) == {first_commit.commit_id, second_commit.commit_id}
+
+def test_resource_cache_updates():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    first_commit = commit_cmd(**base_kwargs, msg="first")
+
+    rit_res = rit_lib.RitResource(root_rit_dir)
+    assert rit_res.get_branch_name_to_commit_ids() == {'main': first_commit.commit_id, 'HEAD': first_commit.commit_id}
+    rit_res.set_branch(rit_lib.Branch('other', first_commit.commit_id))
+    assert sorted(rit_res.get_branch_names()) == ['main', 'other']
+    assert sorted(rit_res.get_commit_id_to_branch_names()[first_commit.commit_id]) == ['HEAD', 'main', 'other']
+    rit_res.set_head(rit_lib.HeadNode(branch_name='other'))
+    assert rit_res.head.branch_name == 'other'
+    rit_res.remove_branch('main')
+    assert rit_res.get_branch_names() == ['other']
+    assert rit_res.get_branch('main') is None
+
+    second_commit = rit_lib.Commit(first_commit.commit_id, 'f' * 64, 1.0, 'second')
+    assert rit_res.get_commit_ids() == [first_commit.commit_id]
+    rit_res.add_commit(second_commit)
+    assert sorted(rit_res.get_commit_ids()) == sorted([first_commit.commit_id, second_commit.commit_id])
+    assert rit_lib.resolve_commit(rit_res, 'fffffff') == second_commit
+
+def test_struct_type_checks():
+  for make in [
+    lambda: rit_lib.Commit(None, 'a' * 64, 1, 'msg'),
+    lambda: rit_lib.Commit(1, 'a' * 64, 1.0, 'msg'),
+    lambda: rit_lib.Branch('name', None),
+    lambda: rit_lib.HeadNode(commit_id=1),
+    lambda: rit_lib.RitResource(None),
+  ]:
+    try:
+      make()
+      assert False
+    except TypeError:
+      pass
+  rit_lib.Commit(None, 'a' * 64, 1.0, 'msg')
+  rit_lib.HeadNode(branch_name='main')
+
+def test_resolve_commit_prefix():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    init_cmd(root_rit_dir=root_rit_dir)
+    rit_res = rit_lib.RitResource(root_rit_dir)
+    first_commit = rit_lib.Commit(None, 'abcdef01' + '0' * 56, 1.0, 'first')
+    second_commit = rit_lib.Commit(None, 'abcdef02' + '0' * 56, 2.0, 'second')
+    rit_res.add_commit(first_commit)
+    assert rit_lib.resolve_commit(rit_res, 'abcdef0') == first_commit
+    # the resolved ref cache is invalidated by new commits
+    assert rit_lib.resolve_ref(rit_res, 'abcdef0').commit == first_commit
+    rit_res.add_commit(second_commit)
+    assert rit_lib.resolve_commit(rit_res, 'abcdef02') == second_commit
+    assert rit_lib.resolve_commit(rit_res, 'abcdef03') is None
+    assert rit_lib.resolve_ref(rit_res, 'abcdef02') is rit_lib.resolve_ref(rit_res, 'abcdef02')
+    assert rit_lib.full_commit_id_re.fullmatch(second_commit.commit_id)
+    assert not rit_lib.full_commit_id_re.fullmatch(second_commit.commit_id + '\n')
+    assert rit_lib.resolve_ref(rit_res, second_commit.commit_id + '\n').commit is None
+    # too short to be a commit id
+    assert rit_lib.resolve_commit(rit_res, 'abcdef') is None
+    for resolve in [rit_lib.resolve_commit, rit_lib.resolve_ref]:
+      try:
+        resolve(rit_res, 'abcdef0')
+        assert False
+      except rit_lib.RitError:
+        pass
+
+def test_validate_branch_name():
+  rit_lib.validate_branch_name('main_2')
+  for name in ['', 'HEAD', 'a b', 'a/b', 'main\n']:
+    try:
+      rit_lib.validate_branch_name(name)
+      assert False
+    except rit_lib.RitError:
+      pass
+
+def test_list_branches_checks_commits():
+  with tempfile.TemporaryDirectory() as root_rit_dir:
+    base_kwargs = dict(root_rit_dir=root_rit_dir)
+    init_cmd(**base_kwargs)
+    touch(root_rit_dir, 'first')
+    commit_cmd(**base_kwargs, msg="first")
+    rit_res = rit_lib.RitResource(root_rit_dir)
+    rit_res.set_branch(rit_lib.Branch('dangling', '0' * 64))
+
+    # a branch without its commit fails regardless of the log level
+    level = rit_lib.logger.level
+    try:
+      for log_level in [logging.INFO, logging.WARNING]:
+        rit_lib.logger.setLevel(log_level)
+        try:
+          branch_cmd(**base_kwargs, name=None, ref=None, force=False, delete=False)
+          assert False
+        except rit_lib.RitError:
+          pass
+    finally:
+      rit_lib.logger.setLevel(level)